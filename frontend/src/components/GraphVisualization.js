@@ -18,7 +18,7 @@ const GraphVisualization = ({ graphData, healthResults }) => {
     const nodes = graphData.nodes.map(node => ({
       data: {
         id: node.id,
-        label: node.label
+        label: node.name || node.label
       }
     }));
 